@@ -0,0 +1,12 @@
+# _shared_ui.py
+#
+# Helpers shared by the desktop mastering GUIs.
+#
+
+import functools
+
+@functools.lru_cache(maxsize=None)
+def get_engine():
+    """Imports the mastering engine (and its numpy/scipy stack) once and hands every GUI the same module."""
+    import audio_mastering_engine
+    return audio_mastering_engine
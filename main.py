@@ -1,14 +1,24 @@
 import os
+import io
 import json
 import base64
+import mimetypes
 import numpy as np
+import soundfile as sf
+import av
 from pydub import AudioSegment
 from pydub.effects import compress_dynamic_range
-from scipy.signal import butter, sosfilt
+from scipy.signal import butter, sosfilt, sosfilt_zi
 import pyloudnorm as pyln
 from google.cloud import storage
 from flask import Flask, request
 
+# Numba is optional: without it the batched IIR filter falls back to scipy, one channel at a time.
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # Initialize Flask App and GCS Client
 app = Flask(__name__)
 storage_client = storage.Client()
@@ -45,38 +55,59 @@ def process_mastering():
     
     # --- Run the Mastering Engine using settings from the frontend ---
     audio = AudioSegment.from_file(temp_input_path)
-    
-    chunk_size_ms = 30 * 1000
-    processed_chunks = []
-    for start_ms in range(0, len(audio), chunk_size_ms):
-        chunk = audio[start_ms:start_ms+chunk_size_ms]
-        chunk_samples = audio_segment_to_float_array(chunk)
-        
-        if float(settings.get("saturation", 0.0)) > 0:
-            chunk_samples = apply_saturation(chunk_samples, float(settings.get("saturation")))
-        processed_samples = apply_eq_to_samples(chunk_samples, chunk.frame_rate, settings)
-        if float(settings.get("width", 1.0)) != 1.0:
-            processed_samples = apply_stereo_width(processed_samples, float(settings.get("width")))
-        processed_chunk = float_array_to_audio_segment(processed_samples, chunk)
-        if settings.get("use_multiband"):
-            processed_chunk = apply_multiband_compressor(processed_chunk, settings)
-        processed_chunks.append(processed_chunk)
-        
-    processed_audio = sum(processed_chunks)
-    final_samples = audio_segment_to_float_array(processed_audio)
+
+    # Parse the settings once per job instead of on every chunk.
+    saturation_gain = 1.0 + max(float(settings.get("saturation", 0.0)), 0.0) * 0.04
+    width = float(settings.get("width", 1.0))
+    eq_gains = (
+        db_to_gain(float(settings.get("bass_boost", 0.0))),
+        db_to_gain(-float(settings.get("mid_cut", 0.0))),
+        db_to_gain(float(settings.get("presence_boost", 0.0))),
+        db_to_gain(float(settings.get("treble_boost", 0.0))),
+    )
+    eq_filters = design_eq_filters(audio.frame_rate, eq_gains)
+    use_multiband = settings.get("use_multiband")
+    multiband_params = (
+        float(settings.get("low_band_threshold", -25.0)), float(settings.get("low_band_ratio", 6.0)),
+        float(settings.get("mid_band_threshold", -20.0)), float(settings.get("mid_band_ratio", 3.0)),
+        float(settings.get("high_band_threshold", -15.0)), float(settings.get("high_band_ratio", 4.0)),
+    )
+
+    # Decode once; each chunk is then a zero-copy row view into the full buffer.
+    sample_rate = audio.frame_rate
+    full_samples = audio_segment_to_float_array(audio)
+    frames_per_chunk = 30 * sample_rate
+    # Every chunk lands in its slice of one preallocated buffer; no chunk list, no final concatenation.
+    processed_samples_out = np.empty_like(full_samples)
+    # EQ filter memory carried from one chunk to the next, so chunk boundaries don't click.
+    eq_filter_state = {}
+    for start in range(0, len(full_samples), frames_per_chunk):
+        stop = start + frames_per_chunk
+        chunk_samples = full_samples[start:stop]
+
+        chunk_samples = apply_saturation(chunk_samples, saturation_gain)
+        processed_samples = apply_eq_to_samples(chunk_samples, eq_filters, eq_filter_state)
+        if width != 1.0:
+            processed_samples = apply_stereo_width(processed_samples, width)
+        if use_multiband:
+            processed_chunk = float_array_to_audio_segment(processed_samples, audio)
+            processed_chunk = apply_multiband_compressor(processed_chunk, *multiband_params)
+            processed_samples_out[start:stop] = audio_segment_to_float_array(processed_chunk)
+        else:
+            np.clip(processed_samples, -1.0, 1.0, out=processed_samples_out[start:stop])
+
+    final_samples = processed_samples_out
     if settings.get("lufs") is not None:
-        final_samples = normalize_to_lufs(final_samples, processed_audio.frame_rate, float(settings.get("lufs")))
+        final_samples = normalize_to_lufs(final_samples, sample_rate, float(settings.get("lufs")))
     final_samples = soft_limiter(final_samples)
-    final_audio = float_array_to_audio_segment(final_samples, processed_audio)
 
     # --- Upload the Processed File ---
-    temp_output_path = f"/tmp/processed-{os.path.basename(file_name)}"
-    output_format = os.path.splitext(file_name)[1][1:] or "wav"
-    final_audio.export(temp_output_path, format=output_format)
-    
+    output_format = os.path.splitext(file_name)[1][1:].lower() or "wav"
+    out_mem_file = encode_audio(final_samples, audio, output_format)
+
     output_blob_name = f"processed/{os.path.basename(file_name)}"
     output_blob = bucket.blob(output_blob_name)
-    output_blob.upload_from_filename(temp_output_path)
+    output_blob.upload_from_file(out_mem_file, content_type=mimetypes.guess_type(output_blob_name)[0])
     
     # --- Create the ".complete" signal file ---
     complete_blob_name = f"processed/{os.path.basename(file_name)}.complete"
@@ -86,25 +117,64 @@ def process_mastering():
     print(f"Successfully processed {file_name} and uploaded to {output_blob_name}")
 
     os.remove(temp_input_path)
-    os.remove(temp_output_path)
     
     return "OK", 200
 
 # --- Helper functions ---
-def apply_saturation(samples, amount):
-    if amount == 0: return samples
-    gain = 1.0 + (amount / 100.0) * 4.0
+# Formats written natively, so only the rest go through pydub's ffmpeg subprocess.
+_SOUNDFILE_FORMATS = {"wav": "WAV", "flac": "FLAC", "aiff": "AIFF", "aif": "AIFF"}
+_PYAV_FORMATS = {"mp3": ("mp3", "mp3"), "aac": ("adts", "aac"), "m4a": ("ipod", "aac")}
+_PYAV_FRAME_SIZE = 1024
+
+def encode_audio(samples, audio_template, output_format):
+    """Encodes the mastered samples into an in-memory file ready for upload."""
+    out_mem_file = io.BytesIO()
+    if output_format in _SOUNDFILE_FORMATS:
+        sf.write(out_mem_file, np.clip(samples, -1.0, 1.0), audio_template.frame_rate,
+                 format=_SOUNDFILE_FORMATS[output_format], subtype="PCM_16")
+    elif output_format in _PYAV_FORMATS:
+        container_format, codec = _PYAV_FORMATS[output_format]
+        encode_with_pyav(out_mem_file, samples, audio_template.frame_rate, container_format, codec)
+    else:
+        float_array_to_audio_segment(samples, audio_template).export(out_mem_file, format=output_format)
+    out_mem_file.seek(0)
+    return out_mem_file
+
+def encode_with_pyav(out_file, samples, sample_rate, container_format, codec):
+    layout = "stereo" if samples.ndim == 2 else "mono"
+    interleaved = samples.reshape(len(samples), -1)
+    with av.open(out_file, mode="w", format=container_format) as container:
+        stream = container.add_stream(codec, rate=sample_rate, layout=layout)
+        for start in range(0, len(interleaved), _PYAV_FRAME_SIZE):
+            block = np.ascontiguousarray(interleaved[start:start+_PYAV_FRAME_SIZE])
+            frame = av.AudioFrame.from_ndarray(block.reshape(1, -1), format="flt", layout=layout)
+            frame.sample_rate = sample_rate
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+
+# Full-scale values per sample width, so decoding never recomputes the power of two.
+_FULL_SCALE = {width: 2 ** (width * 8 - 1) for width in (1, 2, 3, 4)}
+_INV_FULL_SCALE = {width: np.float32(1.0 / scale) for width, scale in _FULL_SCALE.items()}
+
+def db_to_gain(gain_db):
+    return 10 ** (gain_db / 20.0)
+
+def apply_saturation(samples, gain):
+    if gain == 1.0: return samples
     return np.tanh(samples * gain) / gain
 
 def audio_segment_to_float_array(audio_segment):
     samples = np.array(audio_segment.get_array_of_samples())
     if audio_segment.channels == 2:
         samples = samples.reshape((-1, 2))
-    return samples.astype(np.float32) / (2**(audio_segment.sample_width * 8 - 1))
+    # Keep one C-contiguous float32 layout for the whole chain so scipy never has to copy or upcast.
+    return np.ascontiguousarray(samples, dtype=np.float32) * _INV_FULL_SCALE[audio_segment.sample_width]
 
 def float_array_to_audio_segment(float_array, audio_segment_template):
     clipped_array = np.clip(float_array, -1.0, 1.0)
-    int_array = (clipped_array * (2**(audio_segment_template.sample_width * 8 - 1))).astype(np.int16)
+    int_array = (clipped_array * _FULL_SCALE[audio_segment_template.sample_width]).astype(np.int16)
     return audio_segment_template._spawn(int_array.tobytes())
 
 def apply_stereo_width(samples, width_factor):
@@ -113,58 +183,115 @@ def apply_stereo_width(samples, width_factor):
     mid, side = (left + right) / 2, (left - right) / 2
     side *= width_factor
     new_left, new_right = mid + side, mid - side
-    return np.array([new_left, new_right]).T
-
-def apply_eq_to_samples(samples, sample_rate, settings):
-    if samples.ndim > 1 and samples.shape[1] == 2:
-        left, right = samples[:, 0], samples[:, 1]
-        left = apply_shelf_filter(left, sample_rate, 250, float(settings.get("bass_boost", 0.0)), 'low')
-        right = apply_shelf_filter(right, sample_rate, 250, float(settings.get("bass_boost", 0.0)), 'low')
-        left = apply_peak_filter(left, sample_rate, 1000, -float(settings.get("mid_cut", 0.0)))
-        right = apply_peak_filter(right, sample_rate, 1000, -float(settings.get("mid_cut", 0.0)))
-        left = apply_peak_filter(left, sample_rate, 4000, float(settings.get("presence_boost", 0.0)))
-        right = apply_peak_filter(right, sample_rate, 4000, float(settings.get("presence_boost", 0.0)))
-        left = apply_shelf_filter(left, sample_rate, 8000, float(settings.get("treble_boost", 0.0)), 'high')
-        right = apply_shelf_filter(right, sample_rate, 8000, float(settings.get("treble_boost", 0.0)), 'high')
-        return np.array([left, right]).T
-    else:
+    return np.stack([new_left, new_right], axis=1)
+
+def design_eq_filters(sample_rate, eq_gains):
+    """Designs the EQ stages once per job, leaving out any band set to 0 dB."""
+    bass_gain, mid_gain, presence_gain, treble_gain = eq_gains
+    eq_filters = []
+    if bass_gain != 1.0:
+        eq_filters.append(("bass", apply_shelf_filter, design_shelf_filter(sample_rate, 250, 'low'), bass_gain))
+    if mid_gain != 1.0:
+        eq_filters.append(("mid", apply_peak_filter, design_peak_filter(sample_rate, 1000), mid_gain))
+    if presence_gain != 1.0:
+        eq_filters.append(("presence", apply_peak_filter, design_peak_filter(sample_rate, 4000), presence_gain))
+    if treble_gain != 1.0:
+        eq_filters.append(("treble", apply_shelf_filter, design_shelf_filter(sample_rate, 8000, 'high'), treble_gain))
+    return eq_filters
+
+def apply_eq_to_samples(samples, eq_filters, filter_state=None):
+    if not eq_filters or samples.ndim == 1 or samples.shape[1] != 2:
         return samples
+    # Channel-major copy so both channels run through each filter in a single batched call.
+    channels = np.ascontiguousarray(samples.T)
+    for key, apply_filter, sos, gain_factor in eq_filters:
+        channels = apply_filter(channels, sos, gain_factor, state=filter_state, key=key)
+    return np.ascontiguousarray(channels.T)
+
+def _sosfilt_batched_scipy(sos_stack, x_batch, zi_batch):
+    out = np.empty_like(x_batch)
+    for k in range(x_batch.shape[0]):
+        out[k], zi_batch[k] = sosfilt(sos_stack[k], x_batch[k], zi=zi_batch[k])
+    return out
 
-def apply_shelf_filter(samples, sample_rate, cutoff_hz, gain_db, filter_type, order=5):
-    if gain_db == 0: return samples
+if njit is not None:
+    @njit(cache=True, nogil=True)
+    def _sosfilt_batched_numba(sos_stack, x_batch, zi_batch):
+        # One independent biquad cascade per row; the sample recurrence stays sequential in registers.
+        # Not parallel=True: there are only a couple of rows, and parallel regions entered from two Flask
+        # request threads at once abort the process on Numba's fallback (workqueue) threading layer.
+        # nogil lets concurrent requests still filter side by side.
+        n_filters, n_samples = x_batch.shape
+        n_sections = sos_stack.shape[1]
+        out = np.empty_like(x_batch)
+        for k in range(n_filters):
+            for i in range(n_samples):
+                x = x_batch[k, i]
+                for s in range(n_sections):
+                    y = sos_stack[k, s, 0] * x + zi_batch[k, s, 0]
+                    zi_batch[k, s, 0] = sos_stack[k, s, 1] * x - sos_stack[k, s, 4] * y + zi_batch[k, s, 1]
+                    zi_batch[k, s, 1] = sos_stack[k, s, 2] * x - sos_stack[k, s, 5] * y
+                    x = y
+                out[k, i] = x
+        return out
+
+def sosfilt_batched(sos_stack, x_batch, zi_batch):
+    """
+    Runs independent SOS cascades over the rows of x_batch, updating zi_batch in place.
+    Shapes: sos_stack (n_filters, n_sections, 6), x_batch (n_filters, n_samples), zi_batch (n_filters, n_sections, 2).
+    """
+    if njit is not None:
+        return _sosfilt_batched_numba(sos_stack, x_batch, zi_batch)
+    return _sosfilt_batched_scipy(sos_stack, x_batch, zi_batch)
+
+def stateful_sosfilt(sos, channels, state=None, key=None):
+    """Filters each row of `channels` with `sos`, resuming from the filter memory stored under `key` in `state`."""
+    zi = state.get(key) if state is not None else None
+    if zi is None:
+        # Every run starts from the filter's steady state for its first sample, with or without `state`,
+        # so chunked and one-shot filtering agree exactly. Unlike a zero-state sosfilt, this leaves no
+        # start-up transient at the head of the file.
+        zi = (sosfilt_zi(sos)[np.newaxis] * channels[:, 0, np.newaxis, np.newaxis]).astype(np.float32)
+    sos_stack = np.ascontiguousarray(np.broadcast_to(sos, (channels.shape[0],) + sos.shape))
+    filtered_samples = sosfilt_batched(sos_stack, channels, zi)
+    if state is not None:
+        state[key] = zi
+    return filtered_samples
+
+def design_shelf_filter(sample_rate, cutoff_hz, filter_type, order=5):
     nyquist = 0.5 * sample_rate
     normal_cutoff = cutoff_hz / nyquist
-    sos = butter(order, normal_cutoff, btype=filter_type, analog=False, output='sos')
-    filtered_samples = sosfilt(sos, samples)
-    gain_factor = 10 ** (gain_db / 20.0)
-    if gain_db > 0: return samples + (filtered_samples * (gain_factor - 1))
-    else: return samples * gain_factor + (filtered_samples * (1 - gain_factor))
+    return butter(order, normal_cutoff, btype=filter_type, analog=False, output='sos').astype(np.float32)
 
-def apply_peak_filter(samples, sample_rate, center_hz, gain_db, q=1.0):
-    if gain_db == 0: return samples
+def design_peak_filter(sample_rate, center_hz, q=1.0):
     nyquist = 0.5 * sample_rate
     normal_center = center_hz / nyquist
     edge1, edge2 = normal_center / np.sqrt(q), normal_center * np.sqrt(q)
     low_freq, high_freq = min(edge1, edge2), max(edge1, edge2)
     if low_freq >= high_freq: high_freq = low_freq + 1e-9
     if high_freq >= 1.0: high_freq = 0.999999
-    sos = butter(2, [low_freq, high_freq], btype='bandpass', output='sos')
-    filtered_samples = sosfilt(sos, samples)
-    gain_factor = 10 ** (gain_db / 20.0)
+    return butter(2, [low_freq, high_freq], btype='bandpass', output='sos').astype(np.float32)
+
+def apply_shelf_filter(samples, sos, gain_factor, state=None, key=None):
+    if gain_factor == 1.0: return samples
+    filtered_samples = stateful_sosfilt(sos, samples, state, key)
+    if gain_factor > 1.0: return samples + (filtered_samples * (gain_factor - 1))
+    else: return samples * gain_factor + (filtered_samples * (1 - gain_factor))
+
+def apply_peak_filter(samples, sos, gain_factor, state=None, key=None):
+    if gain_factor == 1.0: return samples
+    filtered_samples = stateful_sosfilt(sos, samples, state, key)
     return samples + (filtered_samples * (gain_factor - 1))
 
-def apply_multiband_compressor(chunk, settings):
+def apply_multiband_compressor(chunk, low_thresh, low_ratio, mid_thresh, mid_ratio, high_thresh, high_ratio):
     low_crossover, high_crossover = 250, 4000
-    low_thresh, low_ratio = float(settings.get("low_band_threshold", -25.0)), float(settings.get("low_band_ratio", 6.0))
-    mid_thresh, mid_ratio = float(settings.get("mid_band_threshold", -20.0)), float(settings.get("mid_band_ratio", 3.0))
-    high_thresh, high_ratio = float(settings.get("high_band_threshold", -15.0)), float(settings.get("high_band_ratio", 4.0))
-    low_pass_sos = butter(4, low_crossover, btype='lowpass', fs=chunk.frame_rate, output='sos')
-    high_pass_sos = butter(4, high_crossover, btype='highpass', fs=chunk.frame_rate, output='sos')
+    low_pass_sos = butter(4, low_crossover, btype='lowpass', fs=chunk.frame_rate, output='sos').astype(np.float32)
+    high_pass_sos = butter(4, high_crossover, btype='highpass', fs=chunk.frame_rate, output='sos').astype(np.float32)
     samples = audio_segment_to_float_array(chunk)
     low_band_samples = sosfilt(low_pass_sos, samples, axis=0)
-    temp_high_pass_for_mid = butter(4, low_crossover, btype='highpass', fs=chunk.frame_rate, output='sos')
+    temp_high_pass_for_mid = butter(4, low_crossover, btype='highpass', fs=chunk.frame_rate, output='sos').astype(np.float32)
     mid_band_samples = sosfilt(temp_high_pass_for_mid, samples, axis=0)
-    temp_low_pass_for_mid = butter(4, high_crossover, btype='lowpass', fs=chunk.frame_rate, output='sos')
+    temp_low_pass_for_mid = butter(4, high_crossover, btype='lowpass', fs=chunk.frame_rate, output='sos').astype(np.float32)
     mid_band_samples = sosfilt(temp_low_pass_for_mid, mid_band_samples, axis=0)
     high_band_samples = sosfilt(high_pass_sos, samples, axis=0)
     low_band_chunk = float_array_to_audio_segment(low_band_samples, chunk)
@@ -178,13 +305,13 @@ def apply_multiband_compressor(chunk, settings):
 def normalize_to_lufs(samples, sample_rate, target_lufs=-14.0):
     meter = pyln.Meter(sample_rate)
     if samples.ndim == 2:
-        mono_samples_for_measurement = samples.mean(axis=1)
+        mono_samples_for_measurement = np.float32(0.5) * (samples[:, 0] + samples[:, 1])
     else:
         mono_samples_for_measurement = samples
     loudness = meter.integrated_loudness(mono_samples_for_measurement)
     gain_db = target_lufs - loudness
-    gain_linear = 10.0 ** (gain_db / 20.0)
-    return samples * gain_linear
+    gain_linear = np.float32(10.0 ** (gain_db / 20.0))
+    return np.multiply(samples, gain_linear, dtype=np.float32)
 
 def soft_limiter(samples, threshold=0.98):
     clipped_indices = np.abs(samples) > threshold
@@ -4,9 +4,11 @@
 #
 
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, font
+from tkinter import ttk, filedialog, messagebox
 import threading
+import queue
 import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 
 try:
     from ttkthemes import ThemedTk
@@ -15,19 +17,64 @@ except ImportError:
     exit()
 
 try:
-    import audio_mastering_engine as engine
+    from _shared_ui import get_engine
+    engine = get_engine()
     EQ_PRESETS = engine.EQ_PRESETS
 except ImportError:
     messagebox.showerror("Error", "The 'audio_mastering_engine.py' file was not found.")
     exit()
 
+PRESET_NAMES = ("None", *EQ_PRESETS.keys())
+# (bass, mid cut, presence, treble) per preset, flattened once so applying a preset is a tuple unpack.
+PRESET_VECTORS = {
+    name: (preset.get("bass_boost", 0.0), preset.get("mid_cut", 0.0), preset.get("presence_boost", 0.0), preset.get("treble_boost", 0.0))
+    for name, preset in EQ_PRESETS.items()
+}
+PRESET_VECTORS["None"] = (0.0, 0.0, 0.0, 0.0)
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".aiff")
+AUDIO_FILETYPES = (("Audio Files", "*.wav *.mp3 *.flac *.aiff"),)
+OUTPUT_FILETYPES = (("WAV file", "*.wav"), ("FLAC file", "*.flac"), ("AIFF file", "*.aiff"), ("MP3 file", "*.mp3"))
+OUTPUT_FORMATS = ("wav", "flac", "aiff", "mp3")
+BATCH_OUTPUT_FORMATS = ("wav", "flac", "mp3")
+SLIDER_REFRESH_MS = 30
+# Outcome a status message can carry. Any outcome other than None ends the run and re-enables the buttons;
+# it is passed explicitly because messages include user file names and can't be classified by their text.
+OUTCOME_SUCCESS, OUTCOME_ERROR, OUTCOME_IDLE = "success", "error", "idle"
+
+def master_file(settings):
+    """Runs one file through the engine inside a worker process and returns its last status message."""
+    messages = []
+    engine.process_audio(settings, messages.append)
+    return messages[-1] if messages else ""
+
+def enumerate_audio_files(folder, paths):
+    """Producer: feeds the folder's audio file paths into the queue, then a None sentinel."""
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                    paths.put(entry.path)
+    finally:
+        paths.put(None)
+
+# (settings key, label, from, to, default) for each multiband compressor slider.
+MULTIBAND_SLIDERS = (
+    ("low_band_threshold", "Low Thresh (dB)", -40.0, 0.0, -25.0),
+    ("low_band_ratio", "Low Ratio", 1.0, 12.0, 6.0),
+    ("mid_band_threshold", "Mid Thresh (dB)", -40.0, 0.0, -20.0),
+    ("mid_band_ratio", "Mid Ratio", 1.0, 12.0, 3.0),
+    ("high_band_threshold", "High Thresh (dB)", -40.0, 0.0, -15.0),
+    ("high_band_ratio", "High Ratio", 1.0, 12.0, 4.0),
+)
+
 class MasteringApp(ThemedTk):
     def __init__(self):
         super().__init__(theme="equilux")
 
         self.SCALING_FACTOR = 2.0
-        self.FONT_NORMAL = font.Font(family="Helvetica", size=int(11 * self.SCALING_FACTOR))
-        self.FONT_BOLD = font.Font(family="Helvetica", size=int(11 * self.SCALING_FACTOR), weight="bold")
+        # Font descriptions rather than font.Font objects: ttk resolves them itself, with no named-font allocation.
+        self.FONT_NORMAL = ("Helvetica", int(11 * self.SCALING_FACTOR))
+        self.FONT_BOLD = ("Helvetica", int(11 * self.SCALING_FACTOR), "bold")
         
         self.title("Python Audio Mastering Tool")
         scaled_width = int(700 * self.SCALING_FACTOR)
@@ -78,63 +125,95 @@ class MasteringApp(ThemedTk):
         ttk.Label(batch_frame, textvariable=self.input_folder_path, wraplength=int(500*self.SCALING_FACTOR)).grid(row=0, column=1, sticky="w", padx=5)
         ttk.Button(batch_frame, text="Select Output Folder", command=self.select_output_folder).grid(row=1, column=0, sticky="ew", padx=5, pady=5)
         ttk.Label(batch_frame, textvariable=self.output_folder_path, wraplength=int(500*self.SCALING_FACTOR)).grid(row=1, column=1, sticky="w", padx=5)
+        # WAV/FLAC go through the engine's fast native writer; MP3 still needs an encoder pass per file.
+        self.batch_format_var = tk.StringVar(value=BATCH_OUTPUT_FORMATS[0])
+        ttk.Label(batch_frame, text="Batch Output Format").grid(row=2, column=0, sticky="w", padx=5, pady=5)
+        ttk.Combobox(batch_frame, textvariable=self.batch_format_var, values=BATCH_OUTPUT_FORMATS, state="readonly", width=6).grid(row=2, column=1, sticky="w", padx=5)
         batch_frame.columnconfigure(1, weight=1)
         self.batch_process_button = ttk.Button(batch_frame, text="Start Batch Process", command=self.start_batch_processing, style="Accent.TButton")
-        self.batch_process_button.grid(row=2, column=0, columnspan=2, sticky="ew", pady=10, ipady=int(10*self.SCALING_FACTOR))
+        self.batch_process_button.grid(row=3, column=0, columnspan=2, sticky="ew", pady=10, ipady=int(10*self.SCALING_FACTOR))
 
         # --- SHARED CONTROLS ---
         preset_frame = ttk.LabelFrame(main_frame, text="Presets (Applied to all modes)")
         preset_frame.pack(fill="x", pady=15)
         self.preset_var = tk.StringVar()
-        preset_names = ["None"] + list(EQ_PRESETS.keys())
-        preset_menu = ttk.OptionMenu(preset_frame, self.preset_var, preset_names[0], *preset_names, command=self.apply_preset)
+        preset_menu = ttk.OptionMenu(preset_frame, self.preset_var, PRESET_NAMES[0], *PRESET_NAMES, command=self.apply_preset)
         preset_menu.pack(fill="x", expand=True, ipady=int(5*self.SCALING_FACTOR))
 
         controls_frame = ttk.LabelFrame(main_frame, text="Mastering Parameters")
         controls_frame.pack(fill="x", pady=15)
-        self.saturation = self.create_slider(controls_frame, "Saturation (%)", 0.0, 100.0, 0.0, 0)
-        self.bass_boost = self.create_slider(controls_frame, "Bass (dB)", -6.0, 6.0, 0.0, 1)
-        self.mid_cut = self.create_slider(controls_frame, "Mid Cut (dB)", 0.0, 6.0, 0.0, 2)
-        self.presence_boost = self.create_slider(controls_frame, "Presence (dB)", -6.0, 6.0, 0.0, 3)
-        self.treble_boost = self.create_slider(controls_frame, "Treble (dB)", -6.0, 6.0, 0.0, 4)
-        self.width = self.create_slider(controls_frame, "Stereo Width", 0.0, 2.0, 1.0, 5)
-        self.lufs = self.create_slider(controls_frame, "Target LUFS", -24.0, -6.0, -14.0, 6)
+        # Plain-float mirror of every slider, so reading the settings needs no Tcl round-trips.
+        self._slider_cache = {}
+        self._pending_updates = {}
+        self._value_labels = {}
+        self.saturation = self.create_slider(controls_frame, "saturation", "Saturation (%)", 0.0, 100.0, 0.0, 0)
+        self.bass_boost = self.create_slider(controls_frame, "bass_boost", "Bass (dB)", -6.0, 6.0, 0.0, 1)
+        self.mid_cut = self.create_slider(controls_frame, "mid_cut", "Mid Cut (dB)", 0.0, 6.0, 0.0, 2)
+        self.presence_boost = self.create_slider(controls_frame, "presence_boost", "Presence (dB)", -6.0, 6.0, 0.0, 3)
+        self.treble_boost = self.create_slider(controls_frame, "treble_boost", "Treble (dB)", -6.0, 6.0, 0.0, 4)
+        self.width = self.create_slider(controls_frame, "width", "Stereo Width", 0.0, 2.0, 1.0, 5)
+        self.lufs = self.create_slider(controls_frame, "lufs", "Target LUFS", -24.0, -6.0, -14.0, 6)
         
         self.use_multiband = tk.BooleanVar()
         ttk.Checkbutton(controls_frame, text="Use Multiband Compressor", variable=self.use_multiband, command=self.toggle_multiband_controls).grid(row=7, column=0, columnspan=3, sticky="w", pady=10)
         
-        self.multiband_frame = ttk.LabelFrame(main_frame, text="Multiband Compressor Settings")
-        self.low_band_threshold = self.create_slider(self.multiband_frame, "Low Thresh (dB)", -40.0, 0.0, -25.0, 0)
-        self.low_band_ratio = self.create_slider(self.multiband_frame, "Low Ratio", 1.0, 12.0, 6.0, 1)
-        self.mid_band_threshold = self.create_slider(self.multiband_frame, "Mid Thresh (dB)", -40.0, 0.0, -20.0, 2)
-        self.mid_band_ratio = self.create_slider(self.multiband_frame, "Mid Ratio", 1.0, 12.0, 3.0, 3)
-        self.high_band_threshold = self.create_slider(self.multiband_frame, "High Thresh (dB)", -40.0, 0.0, -15.0, 4)
-        self.high_band_ratio = self.create_slider(self.multiband_frame, "High Ratio", 1.0, 12.0, 4.0, 5)
+        # The multiband sliders are only built the first time the compressor is switched on.
+        self._main_frame = main_frame
+        self.multiband_frame = None
+        self._slider_cache.update((key, default) for key, _, _, _, default in MULTIBAND_SLIDERS)
 
         # --- Status Bar ---
         self.status_var = tk.StringVar(value="Ready.")
         status_label = ttk.Label(self, textvariable=self.status_var, relief="sunken", anchor="w", padding=5, background="#3c3f41", foreground="white")
         status_label.pack(side="bottom", fill="x")
+        # Worker threads never touch Tk directly: messages are queued and drained on the main thread.
+        self._status_queue = queue.Queue()
+        self.bind("<<StatusUpdate>>", self.drain_status)
+
+    def build_multiband_controls(self):
+        self.multiband_frame = ttk.LabelFrame(self._main_frame, text="Multiband Compressor Settings")
+        for row, (key, label, from_, to, default) in enumerate(MULTIBAND_SLIDERS):
+            setattr(self, key, self.create_slider(self.multiband_frame, key, label, from_, to, default, row))
 
     def toggle_multiband_controls(self):
         if self.use_multiband.get():
+            if self.multiband_frame is None:
+                self.build_multiband_controls()
             self.multiband_frame.pack(fill="x", pady=15)
         else:
             self.multiband_frame.pack_forget()
 
-    def create_slider(self, parent, label, from_, to, default, row):
+    def create_slider(self, parent, key, label, from_, to, default, row):
         ttk.Label(parent, text=label).grid(row=row, column=0, sticky="w")
         var = tk.DoubleVar(value=default)
         slider = ttk.Scale(parent, from_=from_, to=to, orient="horizontal", variable=var)
         slider.grid(row=row, column=1, sticky="ew", padx=10, pady=5)
         label_val = ttk.Label(parent, text=f"{default:.1f}", width=5)
         label_val.grid(row=row, column=2, sticky="w")
-        slider.configure(command=lambda v, lbl=label_val: lbl.config(text=f"{float(v):.1f}"))
+        self._slider_cache[key] = float(default)
+        self._value_labels[key] = label_val
+        var.trace_add("write", lambda *_, k=key, v=var: self.schedule_label_update(k, v))
         parent.columnconfigure(1, weight=1)
         return var
 
+    def schedule_label_update(self, key, var):
+        """Coalesces a burst of slider writes into at most one refresh per SLIDER_REFRESH_MS."""
+        if key not in self._pending_updates:
+            self._pending_updates[key] = (self.after(SLIDER_REFRESH_MS, self.apply_label_update, key, var), var)
+
+    def apply_label_update(self, key, var):
+        self._pending_updates.pop(key, None)
+        value = float(var.get())
+        self._slider_cache[key] = value
+        self._value_labels[key].config(text=f"{value:.1f}")
+
+    def flush_label_updates(self):
+        for key, (after_id, var) in list(self._pending_updates.items()):
+            self.after_cancel(after_id)
+            self.apply_label_update(key, var)
+
     def select_input_file(self):
-        path = filedialog.askopenfilename(filetypes=[("Audio Files", "*.wav *.mp3 *.flac *.aiff")])
+        path = filedialog.askopenfilename(filetypes=AUDIO_FILETYPES)
         if path:
             self.input_file_path.set(path)
             if not self.output_file_path.get():
@@ -142,7 +221,7 @@ class MasteringApp(ThemedTk):
                 self.output_file_path.set(f"{base}_mastered{ext}")
 
     def select_output_file(self):
-        path = filedialog.asksaveasfilename(defaultextension=".wav", filetypes=[("WAV file", "*.wav"), ("MP3 file", "*.mp3")])
+        path = filedialog.asksaveasfilename(defaultextension=".wav", filetypes=OUTPUT_FILETYPES)
         if path:
             self.output_file_path.set(path)
             
@@ -157,37 +236,19 @@ class MasteringApp(ThemedTk):
             self.output_folder_path.set(path)
 
     def apply_preset(self, preset_name):
-        def update_labels():
-             for child in self.winfo_children()[0].winfo_children()[2].winfo_children():
-                if isinstance(child, ttk.Label) and child.grid_info()['column'] == 2:
-                    row = child.grid_info()['row']
-                    if row == 1: child.config(text=f"{self.bass_boost.get():.1f}")
-                    if row == 2: child.config(text=f"{self.mid_cut.get():.1f}")
-                    if row == 3: child.config(text=f"{self.presence_boost.get():.1f}")
-                    if row == 4: child.config(text=f"{self.treble_boost.get():.1f}")
-        if preset_name == "None":
-            self.bass_boost.set(0.0); self.mid_cut.set(0.0)
-            self.presence_boost.set(0.0); self.treble_boost.set(0.0)
-        else:
-            settings = EQ_PRESETS[preset_name]
-            self.bass_boost.set(settings.get("bass_boost", 0.0))
-            self.mid_cut.set(settings.get("mid_cut", 0.0))
-            self.presence_boost.set(settings.get("presence_boost", 0.0))
-            self.treble_boost.set(settings.get("treble_boost", 0.0))
-        self.after(50, update_labels)
+        bass, mid, presence, treble = PRESET_VECTORS[preset_name]
+        self.bass_boost.set(bass); self.mid_cut.set(mid)
+        self.presence_boost.set(presence); self.treble_boost.set(treble)
+        # The variable traces have queued label refreshes; apply them now instead of on the next timer tick.
+        self.flush_label_updates()
 
     def get_current_settings(self):
         """Helper to gather all slider values into a dictionary."""
-        return {
-            "saturation": self.saturation.get(),
-            "bass_boost": self.bass_boost.get(), "mid_cut": self.mid_cut.get(),
-            "presence_boost": self.presence_boost.get(), "treble_boost": self.treble_boost.get(),
-            "width": self.width.get(), "lufs": self.lufs.get(),
-            "multiband": self.use_multiband.get(), "compress": False,
-            "low_band_threshold": self.low_band_threshold.get(), "low_band_ratio": self.low_band_ratio.get(),
-            "mid_band_threshold": self.mid_band_threshold.get(), "mid_band_ratio": self.mid_band_ratio.get(),
-            "high_band_threshold": self.high_band_threshold.get(), "high_band_ratio": self.high_band_ratio.get(),
-        }
+        self.flush_label_updates()
+        settings = self._slider_cache.copy()
+        settings["multiband"] = self.use_multiband.get()
+        settings["compress"] = False
+        return settings
 
     def start_single_processing(self):
         settings = self.get_current_settings()
@@ -197,16 +258,41 @@ class MasteringApp(ThemedTk):
         if not settings["input_file"] or not settings["output_file"]:
             messagebox.showerror("Error", "Please select both an input and an output file.")
             return
-        
+
+        # Settle the formats here so the engine can pick its writer up front (and skip MP3 tooling for WAV).
+        if not settings["input_file"].lower().endswith(AUDIO_EXTENSIONS):
+            messagebox.showerror("Error", f"Unsupported input file type. Supported types: {', '.join(AUDIO_EXTENSIONS)}")
+            return
+        settings["output_format"] = os.path.splitext(settings["output_file"])[1].lstrip(".").lower() or "wav"
+        if settings["output_format"] not in OUTPUT_FORMATS:
+            messagebox.showerror("Error", f"Unsupported output format '.{settings['output_format']}'. Choose one of: {', '.join(OUTPUT_FORMATS)}")
+            return
+
         self.process_button.config(state="disabled", text="Processing...")
         self.batch_process_button.config(state="disabled")
         
-        processing_thread = threading.Thread(target=engine.process_audio, args=(settings, self.update_status))
+        processing_thread = threading.Thread(target=self.run_single, args=(settings,))
         processing_thread.daemon = True
         processing_thread.start()
 
+    def run_single(self, settings):
+        """Masters one file on a worker thread, then reports how the run ended."""
+        messages = []
+        def relay(message):
+            messages.append(message)
+            self.update_status(message)
+        try:
+            engine.process_audio(settings, relay)
+        except Exception as e:
+            self.update_status(f"Error: {e}", OUTCOME_ERROR)
+            return
+        # The engine reports its own failures through the callback; its final message says how the run ended.
+        final_message = messages[-1] if messages else "Processing complete."
+        self.update_status(final_message, OUTCOME_ERROR if final_message.lower().startswith("error") else OUTCOME_SUCCESS)
+
     def start_batch_processing(self):
         settings = self.get_current_settings()
+        settings["output_format"] = self.batch_format_var.get()
         input_folder = self.input_folder_path.get()
         output_folder = self.output_folder_path.get()
 
@@ -217,18 +303,82 @@ class MasteringApp(ThemedTk):
         self.process_button.config(state="disabled")
         self.batch_process_button.config(state="disabled", text="Processing...")
 
-        processing_thread = threading.Thread(target=engine.batch_process_audio, args=(settings, input_folder, output_folder, self.update_status))
+        processing_thread = threading.Thread(target=self.run_batch, args=(settings, input_folder, output_folder))
         processing_thread.daemon = True
         processing_thread.start()
 
-    def update_status(self, message):
+    def run_batch(self, settings, input_folder, output_folder):
+        """Masters every audio file in the folder, one file per worker process, while the folder is still being scanned."""
+        n_workers = os.cpu_count() or 1
+        read_ahead = 2 * n_workers
+        pending_paths = queue.Queue(maxsize=read_ahead)
+        threading.Thread(target=enumerate_audio_files, args=(input_folder, pending_paths), daemon=True).start()
+
+        total = done = failures = 0
+        in_flight = {}
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            while True:
+                path = pending_paths.get()
+                if path is None:
+                    break
+                total += 1
+                base = os.path.splitext(os.path.basename(path))[0]
+                file_settings = dict(settings, input_file=path, output_file=os.path.join(output_folder, f"{base}_mastered.{settings['output_format']}"))
+                in_flight[executor.submit(master_file, file_settings)] = os.path.basename(path)
+                # Keep at most `read_ahead` files queued so workers stay busy without over-committing.
+                if len(in_flight) >= read_ahead:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        done += 1
+                        failures += not self.report_batch_result(future, in_flight.pop(future), done)
+            for future in list(in_flight):
+                done += 1
+                failures += not self.report_batch_result(future, in_flight.pop(future), done)
+
+        if not total:
+            self.update_status("No audio files found in the input folder.", OUTCOME_IDLE)
+            return
+        summary = f"Batch processing complete: {total - failures} of {total} files mastered."
+        if failures:
+            summary += f" {failures} file(s) hit an error."
+        # Per-file results carry no outcome, since any outcome ends the run; failures surface in the summary.
+        self.update_status(summary, OUTCOME_ERROR if failures else OUTCOME_SUCCESS)
+
+    def report_batch_result(self, future, name, done):
+        """Posts one finished file to the status bar and returns whether it succeeded."""
+        try:
+            final_message = future.result()
+        except Exception as e:
+            final_message = f"Error: {e}"
+        # As in run_single, the engine reports its own failures through the callback rather than by raising.
+        if final_message.lower().startswith("error"):
+            print(f"Failed to master {name}: {final_message}")
+            self.update_status(f"Failed file {done}: {name}")
+            return False
+        self.update_status(f"Mastered file {done}: {name}")
+        return True
+
+    def update_status(self, message, outcome=None):
+        """Thread-safe status callback: queues the message and wakes the Tk main loop to show it."""
+        self._status_queue.put((message, outcome))
+        self.event_generate("<<StatusUpdate>>", when="tail")
+
+    def drain_status(self, event=None):
+        while True:
+            try:
+                message, outcome = self._status_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.show_status(message, outcome)
+
+    def show_status(self, message, outcome=None):
         self.status_var.set(message)
-        if "complete" in message.lower() or "error" in message.lower() or "no audio files" in message.lower():
+        if outcome is not None:
             self.process_button.config(state="normal", text="Process Single File")
             self.batch_process_button.config(state="normal", text="Start Batch Process")
-            if "complete" in message.lower():
+            if outcome == OUTCOME_SUCCESS:
                 messagebox.showinfo("Success", message)
-            elif "error" in message.lower():
+            elif outcome == OUTCOME_ERROR:
                 messagebox.showerror("Error", message)
 
 if __name__ == "__main__":
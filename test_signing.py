@@ -1,7 +1,9 @@
 # test_signing.py
 # A minimal script to test the generate_signed_url function.
 
+import argparse
 import datetime
+import functools
 from google.cloud import storage
 
 # --- CONFIGURATION ---
@@ -10,24 +12,34 @@ BUCKET_NAME = "tactile-temple-395019-audio-uploads"
 # Use a file that you know exists in your bucket
 FILE_NAME_TO_SIGN = "my_test_beat.wav" 
 
-def test_url_signing():
+@functools.lru_cache(maxsize=1)
+def get_storage_client():
+    """Parses the key file and opens the HTTP session once; repeated signings reuse both."""
+    return storage.Client.from_service_account_json(SERVICE_ACCOUNT_KEY_PATH)
+
+def test_url_signing(check_exists=False):
     """
     Tries to generate a signed URL using the specified key file.
+    V4 signing happens locally with the key's private key; GCS is only contacted when check_exists is set.
     """
     try:
         print("Attempting to create storage client from key file...")
-        storage_client = storage.Client.from_service_account_json(SERVICE_ACCOUNT_KEY_PATH)
+        storage_client = get_storage_client()
         
         bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(f"processed/{FILE_NAME_TO_SIGN}")
-
-        print(f"Checking if blob 'processed/{FILE_NAME_TO_SIGN}' exists...")
-        if not blob.exists():
-            print(f"ERROR: The file 'processed/{FILE_NAME_TO_SIGN}' does not exist in the bucket.")
-            print("Please process a file first, then run this test.")
-            return
 
-        print("Blob exists. Attempting to generate signed URL...")
+        if check_exists:
+            # get_blob() checks existence and fetches metadata in one request (None if missing).
+            print(f"Checking if blob 'processed/{FILE_NAME_TO_SIGN}' exists...")
+            blob = bucket.get_blob(f"processed/{FILE_NAME_TO_SIGN}")
+            if blob is None:
+                print(f"ERROR: The file 'processed/{FILE_NAME_TO_SIGN}' does not exist in the bucket.")
+                print("Please process a file first, then run this test.")
+                return
+            print("Blob exists. Attempting to generate signed URL...")
+        else:
+            blob = bucket.blob(f"processed/{FILE_NAME_TO_SIGN}")
+            print("Attempting to generate signed URL (existence not checked)...")
         
         download_url = blob.generate_signed_url(
             version="v4",
@@ -44,4 +56,7 @@ def test_url_signing():
         print(f"An error occurred: {e}")
 
 if __name__ == "__main__":
-    test_url_signing()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate a V4 signed download URL for a processed file.")
+    parser.add_argument("--check", action="store_true", help="confirm the blob exists in GCS before signing")
+    args = parser.parse_args()
+    test_url_signing(check_exists=args.check)
\ No newline at end of file
@@ -0,0 +1,9 @@
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The service (main.py) and the worker engine are flat modules run from their own folders.
+# The repo root goes first so `main` is the root service, not worker/main.py.
+sys.path.insert(0, REPO_ROOT)
+sys.path.append(os.path.join(REPO_ROOT, "worker"))
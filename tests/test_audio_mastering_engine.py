@@ -0,0 +1,205 @@
+import io
+import wave
+
+import numpy as np
+import pytest
+from pydub import AudioSegment
+
+import audio_mastering_engine as engine
+
+SAMPLE_RATE = 44100
+
+
+def make_segment(samples):
+    """Wraps an (n_frames, n_channels) float array in a 16-bit AudioSegment."""
+    pcm = np.round(np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    return AudioSegment(pcm.tobytes(), frame_rate=SAMPLE_RATE, sample_width=2, channels=samples.shape[1])
+
+
+def noise(n_frames, n_channels, level=0.3, seed=0):
+    rng = np.random.default_rng(seed)
+    return (level * rng.standard_normal((n_frames, n_channels))).astype(np.float32)
+
+
+@pytest.mark.parametrize("channels", [1, 2, 6])
+def test_decode_is_frames_by_channels(channels):
+    samples = noise(1000, channels)
+    decoded = engine.audio_segment_to_float_array(make_segment(samples))
+
+    assert decoded.shape == (1000, channels)
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, np.clip(samples, -1.0, 1.0), atol=2.0 / 32767)
+
+
+@pytest.mark.parametrize("channels", [1, 2, 6])
+def test_wav_blocks_keep_channel_count_and_length(channels):
+    samples = noise(88200, channels)
+    out_file = io.BytesIO()
+    # Small blocks so the file is written in several pieces.
+    engine.write_wav_blocks(out_file, samples.copy(), SAMPLE_RATE, channels, block_frames=10000)
+
+    out_file.seek(0)
+    with wave.open(out_file, 'rb') as wav_file:
+        assert wav_file.getnchannels() == channels
+        assert wav_file.getnframes() == len(samples)
+        written = np.frombuffer(wav_file.readframes(len(samples)), dtype=np.int16).reshape(-1, channels)
+    np.testing.assert_array_equal(written, engine.float_array_to_int16(engine.soft_limiter(samples.copy())))
+
+
+@pytest.mark.parametrize("channels", [1, 2, 6])
+def test_lufs_normalisation_hits_target(channels):
+    import pyloudnorm as pyln
+
+    samples = noise(5 * SAMPLE_RATE, channels, level=0.05)
+    normalised = engine.normalize_to_lufs(samples, SAMPLE_RATE, -14.0)
+
+    meter = pyln.Meter(SAMPLE_RATE)
+    measured = normalised if channels <= 5 else normalised.mean(axis=1)
+    assert meter.integrated_loudness(measured) == pytest.approx(-14.0, abs=0.05)
+
+
+def test_compressor_matches_pydub():
+    from pydub.effects import compress_dynamic_range as pydub_compress
+
+    # 80 Hz tone whose level steps between 0.6 and 0.02 every 250 ms, so it keeps crossing the
+    # -25 dB threshold: each loud step exercises attack, each quiet step release.
+    t = np.arange(int(1.5 * SAMPLE_RATE)) / SAMPLE_RATE
+    level = np.where((t // 0.25) % 2 == 0, 0.6, 0.02)
+    tone = level * np.sin(2 * np.pi * 80 * t)
+    samples = np.stack([tone, 0.7 * tone], axis=1) + noise(len(t), 2, level=0.005)
+    segment = make_segment(samples)
+
+    expected = pydub_compress(segment, threshold=-25.0, ratio=6.0, attack=10.0, release=200.0)
+    expected = engine.audio_segment_to_float_array(expected)
+    actual = engine.compress_dynamic_range(engine.audio_segment_to_float_array(segment), SAMPLE_RATE,
+                                           threshold=-25.0, ratio=6.0, attack=10.0, release=200.0)
+
+    # pydub rounds every frame to int16 after applying gain; that rounding is the only difference.
+    np.testing.assert_allclose(actual, expected, atol=2.0 / 32768)
+    # And the compressor did act: once the attack has settled, a loud step comes out well below its input level.
+    settled = slice(int(0.6 * SAMPLE_RATE), int(0.75 * SAMPLE_RATE))
+    assert np.sqrt(np.mean(actual[settled] ** 2)) < 0.5 * np.sqrt(np.mean(samples[settled] ** 2))
+
+
+EQ_SETTINGS = {"bass_boost": 4.0, "mid_cut": 3.0, "presence_boost": 1.0, "treble_boost": 3.0}
+
+
+@pytest.mark.parametrize("mix", [0.0, 0.09, 1.0])
+def test_fused_saturation_and_eq_matches_scipy(mix):
+    from scipy.signal import sosfilt, sosfilt_zi
+
+    samples = noise(SAMPLE_RATE, 2)
+    sos = engine.design_eq_sos(SAMPLE_RATE, EQ_SETTINGS)
+    mix = np.float32(mix)
+
+    # Reference: saturate, then the same cascade through scipy, started from the same steady state.
+    saturated = engine.saturate(samples, mix) if mix else samples
+    zi = sosfilt_zi(sos)[:, :, np.newaxis] * saturated[0]
+    expected, _ = sosfilt(sos, saturated, axis=0, zi=zi)
+
+    actual = engine.apply_saturation_and_eq(samples, sos, mix)
+    # Both run in float32; the kernel's fastmath reassociation stays below one 16-bit step.
+    np.testing.assert_allclose(actual, expected, atol=1.0 / 32768)
+
+
+@pytest.mark.parametrize("mix", [0.01, 0.09, 0.25, 1.0])
+def test_pade_saturation_tracks_tanh(mix):
+    x = np.linspace(-1.5, 1.5, 30001, dtype=np.float32)
+    mix = np.float32(mix)
+
+    approximated = engine.saturate(x, mix)
+    exact = (1 - mix) * x + mix * np.tanh(x * (1 + 4 * mix))
+
+    assert np.abs(approximated - exact).max() <= 0.024
+    # The approximant's slope is 9(d^2 - 9)^2 / (27 + 9d^2)^2 >= 0, and the clamp keeps it flat past +/-3:
+    # monotonic up to float32 rounding where the slope reaches zero.
+    assert np.all(np.diff(approximated) >= -np.finfo(np.float32).eps)
+    assert np.abs(engine.saturate(np.float32(100.0), mix) - ((1 - mix) * 100.0 + mix)) < 1e-3
+
+
+def test_soft_limiter_matches_masked_formula():
+    samples = noise(20000, 2, level=0.8, seed=3) * 1.5
+
+    expected = samples.copy()
+    over = np.abs(expected) > 0.98
+    expected[over] = (0.98 + (np.abs(expected[over]) - 0.98) / (1 + ((np.abs(expected[over]) - 0.98) / 0.02) ** 2) ** 0.5) * np.sign(expected[over])
+
+    limited = engine.soft_limiter(samples.copy())
+
+    assert limited.shape == samples.shape
+    np.testing.assert_allclose(limited, expected, atol=1e-6)
+    assert np.abs(limited).max() < 0.98 + 0.02
+
+
+@pytest.mark.parametrize("channels", [2, 6])
+def test_block_path_matches_single_pass(channels):
+    audio = make_segment(noise(3 * SAMPLE_RATE, channels, seed=4))
+    settings = dict(EQ_SETTINGS, saturation=30, width=1.4, multiband=True, lufs=-14.0)
+
+    single_pass = engine.process_audio_segment(audio, settings, in_memory_limit_bytes=len(audio.raw_data))
+    # A limit of 0 forces the block path; 0.43 s blocks give a short last block too.
+    blocks = engine.process_audio_segment(audio, settings, in_memory_limit_bytes=0, chunk_seconds=0.43)
+
+    assert blocks.shape == single_pass.shape == (3 * SAMPLE_RATE, channels)
+    np.testing.assert_array_equal(blocks, single_pass)
+
+
+def test_failed_upload_is_cancelled_not_finalised(monkeypatch):
+    import gc
+    from unittest import mock
+
+    from google.cloud.storage.fileio import BlobWriter
+
+    upload, transport = mock.Mock(upload_url="https://upload/session"), mock.Mock()
+    writers = []
+
+    def open_writer(mode, **kwargs):
+        writer = BlobWriter(mock.Mock(chunk_size=engine.GCS_CHUNK_SIZE), ignore_flush=True)
+        # Stands in for starting the resumable session, so chunks go to the mocked upload.
+        writer._initiate_upload = lambda: setattr(writer, "_upload_and_transport", (upload, transport))
+        writers.append(writer)
+        return writer
+
+    def failing_write(out_file, samples, sample_rate, channels, block_frames):
+        out_file.write(b"\0" * (engine.GCS_CHUNK_SIZE + 1000))
+        raise RuntimeError("encoder failed")
+
+    bucket = mock.Mock()
+    bucket.blob.return_value.download_as_bytes.return_value = b""
+    bucket.blob.return_value.open.side_effect = open_writer
+    monkeypatch.setattr(engine, "get_bucket", lambda name: bucket)
+    monkeypatch.setattr(engine.AudioSegment, "from_file", lambda f: make_segment(noise(SAMPLE_RATE // 10, 2)))
+    monkeypatch.setattr(engine, "write_wav_blocks", failing_write)
+
+    with pytest.raises(RuntimeError, match="encoder failed"):
+        engine.process_audio_from_gcs("gs://bucket/song.wav", {})
+
+    del writers[:]
+    gc.collect()
+    # Only the one full chunk went out; the remainder was never sent as a final chunk.
+    assert upload.transmit_next_chunk.call_count == 1
+    transport.delete.assert_called_once_with("https://upload/session")
+    assert not any(call.args and str(call.args[0]).endswith(".complete") for call in bucket.blob.call_args_list)
+
+
+def test_concurrent_jobs_match_sequential_runs():
+    import numba
+    from concurrent.futures import ThreadPoolExecutor
+
+    settings = dict(EQ_SETTINGS, saturation=30, width=1.4, multiband=True, lufs=-14.0)
+    segments = [make_segment(noise(2 * SAMPLE_RATE, 2, seed=seed)) for seed in (5, 6)]
+
+    def job(segment):
+        # Processing plus the limiter pass done at encode time: both parallel kernels.
+        return engine.soft_limiter(engine.process_audio_segment(segment, settings))
+
+    sequential = [job(segment) for segment in segments]
+
+    # Jobs run side by side on the worker's threads, each entering the parallel kernels.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for _ in range(3):
+            concurrent = list(executor.map(job, segments))
+            for result, expected in zip(concurrent, sequential):
+                np.testing.assert_array_equal(result, expected)
+
+    assert numba.threading_layer() in ("tbb", "omp")
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+import textwrap
+from unittest import mock
+
+import numpy as np
+import pytest
+from scipy.signal import sosfilt
+
+SAMPLE_RATE = 44100
+
+
+@pytest.fixture(scope="module")
+def service():
+    # main.py builds a storage client at import time; no GCS access is needed for the DSP helpers.
+    with mock.patch("google.cloud.storage.Client"):
+        import main
+    return main
+
+
+@pytest.fixture
+def stereo():
+    rng = np.random.default_rng(0)
+    return (0.3 * rng.standard_normal((5 * SAMPLE_RATE, 2))).astype(np.float32)
+
+
+def test_chunked_eq_matches_single_pass(service, stereo):
+    gains = tuple(service.db_to_gain(db) for db in (4.0, -3.0, 1.0, 3.0))
+    eq_filters = service.design_eq_filters(SAMPLE_RATE, gains)
+
+    single_pass = service.apply_eq_to_samples(stereo, eq_filters)
+
+    filter_state = {}
+    frames_per_chunk = 30011
+    chunked = np.concatenate([
+        service.apply_eq_to_samples(stereo[start:start + frames_per_chunk], eq_filters, filter_state)
+        for start in range(0, len(stereo), frames_per_chunk)
+    ])
+
+    np.testing.assert_array_equal(chunked, single_pass)
+
+
+def test_steady_state_seed_only_changes_the_head(service, stereo):
+    sos = service.design_shelf_filter(SAMPLE_RATE, 250, 'low')
+    channels = np.ascontiguousarray(stereo.T)
+
+    seeded = service.stateful_sosfilt(sos, channels)
+    zero_state = sosfilt(sos, channels, axis=1)
+
+    # The seed removes the start-up transient, so the head differs from a zero-state filter...
+    assert np.abs(seeded[:, :100] - zero_state[:, :100]).max() > 1e-3
+    # ...but the two converge once the transient has decayed.
+    np.testing.assert_allclose(seeded[:, SAMPLE_RATE:], zero_state[:, SAMPLE_RATE:], atol=1e-5)
+
+
+CONCURRENT_FILTERING = textwrap.dedent("""
+    import threading
+    from unittest import mock
+    import numpy as np
+    with mock.patch("google.cloud.storage.Client"):
+        import main
+    sos = np.stack([main.butter(4, 1000, fs=44100, output="sos")] * 2)
+    x = np.random.default_rng(0).standard_normal((2, 1000000))
+    barrier = threading.Barrier(2)
+    def run():
+        barrier.wait()
+        for _ in range(3):
+            main.sosfilt_batched(sos, x, np.zeros((2, sos.shape[1], 2)))
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+""")
+
+
+def test_concurrent_requests_can_filter_on_the_workqueue_layer(service):
+    # The Flask server filters on request threads; a parallel kernel entered twice at once would abort the
+    # process on Numba's workqueue layer, which is what a slim image without TBB or libgomp falls back to.
+    env = dict(os.environ, NUMBA_THREADING_LAYER="workqueue")
+    result = subprocess.run([sys.executable, "-c", CONCURRENT_FILTERING], cwd=os.path.dirname(service.__file__),
+                            env=env, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
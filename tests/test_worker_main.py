@@ -0,0 +1,54 @@
+import base64
+import importlib.util
+import json
+import os
+import threading
+
+import pytest
+
+WORKER_MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "worker", "main.py")
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    # Loaded from its path: `main` on sys.path is the root service.
+    monkeypatch.setenv("MASTERING_WORKERS", "1")
+    monkeypatch.setenv("MAX_JOBS_IN_FLIGHT", "1")
+    spec = importlib.util.spec_from_file_location("worker_main", WORKER_MAIN)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    module.job_executor.shutdown(wait=True)
+
+
+def push(worker, gcs_uri):
+    """Delivers one push message to the handler and returns the HTTP status it answers with."""
+    data = base64.b64encode(json.dumps({"gcs_uri": gcs_uri, "settings": {"lufs": -14.0}}).encode()).decode()
+    with worker.app.test_request_context("/", method="POST", json={"message": {"data": data}}):
+        _, status = worker.process_mastering_job()
+    return status
+
+
+def test_busy_worker_refuses_jobs_until_a_slot_frees(worker, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    finished = []
+
+    def fake_job(gcs_uri, settings):
+        started.set()
+        release.wait(5)
+        finished.append(gcs_uri)
+
+    monkeypatch.setattr(worker, "process_audio_from_gcs", fake_job)
+
+    assert push(worker, "gs://bucket/a.wav") == 204
+    assert started.wait(5)
+    # Not acknowledged, so Pub/Sub keeps the message and redelivers it.
+    assert push(worker, "gs://bucket/b.wav") == 429
+
+    release.set()
+    # The slot is freed once the job ends, after which the redelivered message is accepted.
+    assert worker.job_slots.acquire(timeout=5)
+    worker.job_slots.release()
+    assert push(worker, "gs://bucket/b.wav") == 204
+    worker.job_executor.shutdown(wait=True)
+    assert finished == ["gs://bucket/a.wav", "gs://bucket/b.wav"]
@@ -3,14 +3,23 @@
 # It reads files from GCS, processes them, and uploads the results.
 
 import os
+import wave
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from pydub import AudioSegment
-from pydub.effects import compress_dynamic_range
-from scipy.signal import butter, sosfilt
+from scipy.signal import butter, sosfilt, sosfilt_zi
+import numba
+from numba import njit, prange
 import pyloudnorm as pyln
 from google.cloud import storage
 import io
 
+# The worker runs jobs on several threads, and each enters the parallel=True kernels below. Only the TBB and
+# OpenMP layers are safe for that (tbb is in requirements.txt); Numba's workqueue fallback aborts the process
+# when two threads enter a parallel region at once, so a missing layer fails loudly at the first call instead.
+numba.config.THREADING_LAYER = 'threadsafe'
+
 # --- PRESET DEFINITIONS ---
 EQ_PRESETS = {
     "techno": { "bass_boost": 4.0, "mid_cut": 3.0, "presence_boost": 1.0, "treble_boost": 3.0, "description": "Boosted sub-bass and highs, scooped mids for a powerful club sound." },
@@ -21,85 +30,57 @@ EQ_PRESETS = {
 
 # --- GCS-SPECIFIC MASTERING FUNCTION ---
 
+# Resumable upload chunk size; must be a multiple of 256 KiB.
+GCS_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Decoded PCM up to this size is processed as one buffer; larger files go through in CHUNK_SECONDS blocks,
+# so the per-stage temporaries (EQ output, the three compressor bands) stay block-sized.
+IN_MEMORY_LIMIT_BYTES = 200 * 1024 * 1024
+CHUNK_SECONDS = 30
+
+@functools.lru_cache(maxsize=1)
+def get_storage_client():
+    """Created on first use, then shared by every job so credentials and HTTP connections are reused."""
+    return storage.Client()
+
+@functools.lru_cache(maxsize=None)
+def get_bucket(bucket_name):
+    return get_storage_client().bucket(bucket_name)
+
 def process_audio_from_gcs(gcs_uri, settings):
     """
     Main cloud function entry point. Downloads, processes, and re-uploads an audio file.
     """
     try:
-        storage_client = storage.Client()
-        
         # 1. DOWNLOAD THE FILE FROM GCS
         print(f"Downloading file from {gcs_uri}...")
         bucket_name, blob_name = gcs_uri.replace("gs://", "").split("/", 1)
-        bucket = storage_client.bucket(bucket_name)
+        bucket = get_bucket(bucket_name)
         blob = bucket.blob(blob_name)
         
-        # Download the file's content into an in-memory bytes buffer
-        in_mem_file = io.BytesIO()
-        blob.download_to_file(in_mem_file)
-        in_mem_file.seek(0) # Rewind the buffer to the beginning
+        # Fetch the whole object in one allocation; raw_download skips decompressive transcoding.
+        in_mem_file = io.BytesIO(blob.download_as_bytes(raw_download=True))
         
         # Load the audio data from the in-memory buffer using pydub
         audio = AudioSegment.from_file(in_mem_file)
         print("File downloaded and loaded into memory.")
 
-        # 2. RUN THE CORE PROCESSING LOGIC (CHUNK-BASED)
-        print("Processing audio in chunks...")
-        chunk_size_ms = 30 * 1000
-        processed_chunks = []
-        
-        num_chunks = len(range(0, len(audio), chunk_size_ms))
-        
-        for i, start_ms in enumerate(range(0, len(audio), chunk_size_ms)):
-            chunk = audio[start_ms:start_ms+chunk_size_ms]
-            chunk_samples = audio_segment_to_float_array(chunk)
-            
-            # Apply all effects based on the user's settings
-            processed_samples = apply_saturation(chunk_samples, settings.get("saturation", 0))
-            processed_samples = apply_eq_to_samples(processed_samples, chunk.frame_rate, settings)
-            if settings.get("width", 1.0) != 1.0:
-                processed_samples = apply_stereo_width(processed_samples, settings.get("width"))
-                
-            processed_chunk = float_array_to_audio_segment(processed_samples, chunk)
-            
-            if settings.get("multiband"):
-                # Use the new detailed settings for the multiband compressor
-                low_thresh = settings.get('low_thresh', -25.0)
-                low_ratio = settings.get('low_ratio', 6.0)
-                mid_thresh = settings.get('mid_thresh', -20.0)
-                mid_ratio = settings.get('mid_ratio', 3.0)
-                high_thresh = settings.get('high_thresh', -15.0)
-                high_ratio = settings.get('high_ratio', 4.0)
-                processed_chunk = apply_multiband_compressor(processed_chunk, low_thresh, low_ratio, mid_thresh, mid_ratio, high_thresh, high_ratio)
-            # The simple compressor is not used if multiband is on.
-            
-            processed_chunks.append(processed_chunk)
-            print(f"Processed chunk {i+1}/{num_chunks}...")
-            
-        print("Assembling processed chunks...")
-        processed_audio = sum(processed_chunks)
-        
-        final_samples = audio_segment_to_float_array(processed_audio)
-
-        if settings.get("lufs") is not None:
-            print("Normalizing loudness...")
-            final_samples = normalize_to_lufs(final_samples, processed_audio.frame_rate, settings.get("lufs"))
-
-        final_samples = soft_limiter(final_samples)
-        final_audio = float_array_to_audio_segment(final_samples, processed_audio)
+        # 2. RUN THE CORE PROCESSING LOGIC
+        print("Processing audio...")
+        final_samples = process_audio_segment(audio, settings)
 
         # 3. UPLOAD THE PROCESSED FILE BACK TO GCS
         output_filename = f"processed/mastered_{os.path.basename(blob_name)}"
-        output_blob = bucket.blob(output_filename)
-        
-        print(f"Exporting and uploading processed audio to {output_filename}...")
-        # Export the file to an in-memory buffer
-        out_mem_file = io.BytesIO()
-        final_audio.export(out_mem_file, format="wav")
-        out_mem_file.seek(0)
+        output_blob = bucket.blob(output_filename, chunk_size=GCS_CHUNK_SIZE)
         
-        # Upload the buffer's content to the new blob
-        output_blob.upload_from_file(out_mem_file, content_type='audio/wav')
+        print(f"Encoding and uploading processed audio to {output_filename}...")
+        # Limiting and encoding run block by block while the previous block uploads in the background.
+        # The resumable upload (the client-side CRC32C pass is skipped) is only finalised if every block made it:
+        # on an error the writer's context exit cancels the upload session, so no truncated object is created.
+        # Merely skipping close() is not enough, as the writer would finalise the upload when garbage-collected.
+        with output_blob.open("wb", content_type='audio/wav', checksum=None) as blob_writer:
+            with BackgroundWriter(blob_writer) as out_file:
+                write_wav_blocks(out_file, final_samples, audio.frame_rate, audio.channels, GCS_CHUNK_SIZE // (2 * audio.channels))
         print("Processed file uploaded.")
 
         # 4. CREATE THE ".complete" FLAG FILE
@@ -112,116 +93,341 @@ def process_audio_from_gcs(gcs_uri, settings):
         # Re-raise the exception to be caught by the main function if needed
         raise
 
+def process_audio_segment(audio, settings, in_memory_limit_bytes=None, chunk_seconds=None):
+    """
+    Runs the mastering chain on a decoded AudioSegment and returns (frames, channels) float32 samples.
+    Files larger than in_memory_limit_bytes are processed in blocks of chunk_seconds (defaults:
+    IN_MEMORY_LIMIT_BYTES and CHUNK_SECONDS).
+    """
+    if in_memory_limit_bytes is None:
+        in_memory_limit_bytes = IN_MEMORY_LIMIT_BYTES
+    if chunk_seconds is None:
+        chunk_seconds = CHUNK_SECONDS
+
+    # Filter coefficients depend only on the settings and sample rate, so they are designed once per job.
+    saturation_mix = np.float32((settings.get("saturation", 0) / 100.0) ** 2)
+    eq_sos = design_eq_sos(audio.frame_rate, settings)
+    crossover_sos = design_crossover_sos(audio.frame_rate) if settings.get("multiband") else None
+    width = settings.get("width", 1.0)
+
+    multiband_params = None
+    if settings.get("multiband"):
+        # Use the new detailed settings for the multiband compressor
+        low_thresh = settings.get('low_thresh', -25.0)
+        low_ratio = settings.get('low_ratio', 6.0)
+        mid_thresh = settings.get('mid_thresh', -20.0)
+        mid_ratio = settings.get('mid_ratio', 3.0)
+        high_thresh = settings.get('high_thresh', -15.0)
+        high_ratio = settings.get('high_ratio', 4.0)
+        multiband_params = (low_thresh, low_ratio, mid_thresh, mid_ratio, high_thresh, high_ratio)
+    # The simple compressor is not used if multiband is on.
+
+    def process_block(samples, filter_state=None):
+        # Apply all effects based on the user's settings
+        processed = apply_saturation_and_eq(samples, eq_sos, saturation_mix, filter_state)
+        if width != 1.0:
+            processed = apply_stereo_width(processed, width)
+        if multiband_params is not None:
+            processed = apply_multiband_compressor(processed, audio.frame_rate, crossover_sos, *multiband_params, filter_state=filter_state)
+        return processed
+
+    if len(audio.raw_data) <= in_memory_limit_bytes:
+        # Common case: the whole file is processed as one buffer.
+        final_samples = process_block(audio_segment_to_float_array(audio))
+    else:
+        # Filter and compressor state is carried across blocks, so the result matches a single pass exactly.
+        block_frames = int(chunk_seconds * audio.frame_rate)
+        total_frames = int(audio.frame_count())
+        final_samples = None
+        filter_state = {}
+        for start in range(0, total_frames, block_frames):
+            stop = min(start + block_frames, total_frames)
+            processed_block = process_block(audio_segment_to_float_array(audio, start, stop), filter_state)
+            if final_samples is None:
+                final_samples = np.empty((total_frames,) + processed_block.shape[1:], dtype=np.float32)
+            final_samples[start:stop] = processed_block
+
+    if settings.get("lufs") is not None:
+        print("Normalizing loudness...")
+        final_samples = normalize_to_lufs(final_samples, audio.frame_rate, settings.get("lufs"))
+    return final_samples
+
 # --- CORE AUDIO HELPER FUNCTIONS ---
 
-def audio_segment_to_float_array(audio_segment):
-    samples = np.array(audio_segment.get_array_of_samples())
-    if audio_segment.channels == 2:
-        samples = samples.reshape((-1, 2))
-    return samples.astype(np.float32) / (2**(audio_segment.sample_width * 8 - 1))
+# pydub keeps PCM as signed little-endian integers (8-bit is re-biased, 24-bit widened to 32), keyed by sample width.
+SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+class BackgroundWriter:
+    """Write-only file wrapper that passes each write to a background thread, keeping one write in flight."""
+
+    def __init__(self, raw_file):
+        self._raw_file = raw_file
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    def write(self, data):
+        self.flush()
+        self._pending = self._executor.submit(self._raw_file.write, data)
+        return len(data)
 
-def float_array_to_audio_segment(float_array, audio_segment_template):
+    def flush(self):
+        # Waits for the in-flight write and re-raises its error, if any.
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
+
+def write_wav_blocks(out_file, samples, sample_rate, channels, block_frames):
+    """Soft-limits and writes samples as 16-bit WAV, one block of frames at a time."""
+    frames = samples.reshape(-1, channels)
+    with wave.open(out_file, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        # Declaring the length up front lets the header go out first, with no seek back to patch it.
+        wav_file.setnframes(len(frames))
+        for start in range(0, len(frames), block_frames):
+            block = soft_limiter(frames[start:start + block_frames])
+            wav_file.writeframesraw(float_array_to_int16(block))
+
+def audio_segment_to_float_array(audio_segment, start=None, stop=None):
+    # View the segment's bytes in place, then cast and scale to float32 in a single pass.
+    # Always (n_frames, n_channels), mono included, so start/stop select frames for any channel count.
+    samples = np.frombuffer(audio_segment.raw_data, dtype=SAMPLE_DTYPES[audio_segment.sample_width])
+    samples = samples.reshape((-1, audio_segment.channels))
+    scale = 1.0 / (2**(audio_segment.sample_width * 8 - 1))
+    return np.multiply(samples[start:stop], scale, dtype=np.float32)
+
+def float_array_to_int16(float_array):
     clipped_array = np.clip(float_array, -1.0, 1.0)
-    int_array = (clipped_array * (2**(audio_segment_template.sample_width * 8 - 1))).astype(np.int16)
-    return audio_segment_template._spawn(int_array.tobytes())
+    # Scale straight into the int16 output buffer rather than through a scaled float temporary.
+    int_array = np.empty(clipped_array.shape, dtype=np.int16)
+    np.multiply(clipped_array, 32767.0, out=int_array, casting='unsafe')
+    return int_array
 
-def apply_saturation(samples, saturation_percent):
-    if saturation_percent == 0:
+def apply_saturation_and_eq(samples, sos, mix, filter_state=None):
+    """
+    Saturation followed by the EQ cascade, fused into one compiled pass with no intermediate arrays.
+    With a filter_state dict, the EQ memory is carried over between consecutive blocks of the same file.
+    """
+    if mix == 0 and len(sos) == 0:
         return samples
-    mix = (saturation_percent / 100.0) ** 2
-    clean_signal = samples
-    distorted_signal = np.tanh(samples * (1 + mix * 4))
-    return (1 - mix) * clean_signal + mix * distorted_signal
+    frames = samples.reshape(len(samples), -1)
+    zi = filter_state.get('eq') if filter_state is not None else None
+    if zi is None:
+        # Start from the filters' steady state for the first (saturated) frame instead of from silence.
+        zi = (sosfilt_zi(sos)[np.newaxis] * saturate(frames[0], mix)[:, np.newaxis, np.newaxis]).astype(np.float32)
+    processed = _saturate_and_eq_kernel(frames, sos, mix, zi)
+    if filter_state is not None:
+        filter_state['eq'] = zi
+    return processed.reshape(samples.shape)
+
+@njit(cache=True)
+def saturate(x, mix):
+    # tanh is replaced by its [3/2] Pade approximant, clamped at +/-3 where it reaches exactly +/-1:
+    # within 0.024 of tanh, and plain multiply/divide instead of a libm call per sample.
+    # float32 literals keep float32 inputs from being promoted to float64.
+    driven = np.minimum(np.maximum(x * (np.float32(1.0) + mix * np.float32(4.0)), np.float32(-3.0)), np.float32(3.0))
+    driven_sq = driven * driven
+    distorted = driven * (np.float32(27.0) + driven_sq) / (np.float32(27.0) + np.float32(9.0) * driven_sq)
+    return (np.float32(1.0) - mix) * x + mix * distorted
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _saturate_and_eq_kernel(frames, sos, mix, zi):
+    # frames is (n_frames, n_channels); each channel is independent, so channels run in parallel.
+    # Per sample: saturation blend, then every biquad in Direct Form II Transposed.
+    # zi is (n_channels, n_sections, 2) and is updated in place to the state after the last frame.
+    n_frames, n_channels = frames.shape
+    n_sections = sos.shape[0]
+    out = np.empty_like(frames)
+    for ch in prange(n_channels):
+        z = zi[ch]
+        for i in range(n_frames):
+            x = frames[i, ch]
+            if mix != 0.0:
+                x = saturate(x, mix)
+            for s in range(n_sections):
+                y = sos[s, 0] * x + z[s, 0]
+                z[s, 0] = sos[s, 1] * x - sos[s, 4] * y + z[s, 1]
+                z[s, 1] = sos[s, 2] * x - sos[s, 5] * y
+                x = y
+            out[i, ch] = x
+    return out
 
 def apply_stereo_width(samples, width_factor):
     if samples.ndim == 1 or samples.shape[1] != 2: return samples
     left, right = samples[:, 0], samples[:, 1]
-    mid = (left + right) / 2
-    side = (left - right) / 2
-    side *= width_factor
-    new_left = mid + side
-    new_right = mid - side
-    return np.array([new_left, new_right]).T
-
-def apply_eq_to_samples(samples, sample_rate, settings):
+    mid = left + right
+    mid *= np.float32(0.5)
+    side = left - right
+    side *= np.float32(0.5 * width_factor)
+    # Written back into the (N, 2) array itself, so the layout stays C-contiguous and no new buffer is built.
+    np.add(mid, side, out=left)
+    np.subtract(mid, side, out=right)
+    return samples
+
+def design_eq_sos(sample_rate, settings):
+    """Stacks the active EQ bands into one (n_sections, 6) SOS matrix; bands at 0 dB are left out."""
     bass_boost = settings.get("bass_boost", 0.0)
     mid_cut = settings.get("mid_cut", 0.0)
     presence_boost = settings.get("presence_boost", 0.0)
     treble_boost = settings.get("treble_boost", 0.0)
-    
-    if samples.ndim > 1 and samples.shape[1] == 2: # Stereo
-        left, right = samples[:, 0], samples[:, 1]
-        left = apply_shelf_filter(left, sample_rate, 250, bass_boost, 'low')
-        right = apply_shelf_filter(right, sample_rate, 250, bass_boost, 'low')
-        left = apply_peak_filter(left, sample_rate, 1000, -mid_cut)
-        right = apply_peak_filter(right, sample_rate, 1000, -mid_cut)
-        left = apply_peak_filter(left, sample_rate, 4000, presence_boost)
-        right = apply_peak_filter(right, sample_rate, 4000, presence_boost)
-        left = apply_shelf_filter(left, sample_rate, 8000, treble_boost, 'high')
-        right = apply_shelf_filter(right, sample_rate, 8000, treble_boost, 'high')
-        return np.array([left, right]).T
-    else: # Mono
-        samples = apply_shelf_filter(samples, sample_rate, 250, bass_boost, 'low')
-        samples = apply_peak_filter(samples, sample_rate, 1000, -mid_cut)
-        samples = apply_peak_filter(samples, sample_rate, 4000, presence_boost)
-        samples = apply_shelf_filter(samples, sample_rate, 8000, treble_boost, 'high')
-        return samples
 
-def apply_shelf_filter(samples, sample_rate, cutoff_hz, gain_db, filter_type, q=0.707):
-    if gain_db == 0: return samples
+    sections = [
+        design_shelf_filter(sample_rate, 250, bass_boost, 'low'),
+        design_peak_filter(sample_rate, 1000, -mid_cut),
+        design_peak_filter(sample_rate, 4000, presence_boost),
+        design_shelf_filter(sample_rate, 8000, treble_boost, 'high'),
+    ]
+    return np.array([section for section in sections if section is not None], dtype=np.float32).reshape(-1, 6)
+
+def design_shelf_filter(sample_rate, cutoff_hz, gain_db, filter_type, q=0.707):
+    """Returns one RBJ shelf biquad as an SOS row, or None when the gain is 0 dB."""
+    if gain_db == 0: return None
     nyquist = 0.5 * sample_rate
     Wn = cutoff_hz / nyquist
     gain = 10.0**(gain_db / 20.0)
+    cos_w0 = np.cos(Wn*2*np.pi)
     alpha = np.sin(Wn*2*np.pi) / (2.0 * q)
+    shelf_term = 2*np.sqrt(gain)*alpha
     if filter_type == 'low':
-        b0, b1, b2 = gain*((gain+1)-(gain-1)*np.cos(Wn*2*np.pi)+2*np.sqrt(gain)*alpha), 2*gain*((gain-1)-(gain+1)*np.cos(Wn*2*np.pi)), gain*((gain+1)-(gain-1)*np.cos(Wn*2*np.pi)-2*np.sqrt(gain)*alpha)
-        a0, a1, a2 = (gain+1)+(gain-1)*np.cos(Wn*2*np.pi)+2*np.sqrt(gain)*alpha, -2*((gain-1)+(gain+1)*np.cos(Wn*2*np.pi)), (gain+1)+(gain-1)*np.cos(Wn*2*np.pi)-2*np.sqrt(gain)*alpha
+        b0, b1, b2 = gain*((gain+1)-(gain-1)*cos_w0+shelf_term), 2*gain*((gain-1)-(gain+1)*cos_w0), gain*((gain+1)-(gain-1)*cos_w0-shelf_term)
+        a0, a1, a2 = (gain+1)+(gain-1)*cos_w0+shelf_term, -2*((gain-1)+(gain+1)*cos_w0), (gain+1)+(gain-1)*cos_w0-shelf_term
     else:
-        b0, b1, b2 = gain*((gain+1)+(gain-1)*np.cos(Wn*2*np.pi)+2*np.sqrt(gain)*alpha), -2*gain*((gain-1)+(gain+1)*np.cos(Wn*2*np.pi)), gain*((gain+1)+(gain-1)*np.cos(Wn*2*np.pi)-2*np.sqrt(gain)*alpha)
-        a0, a1, a2 = (gain+1)-(gain-1)*np.cos(Wn*2*np.pi)+2*np.sqrt(gain)*alpha, 2*((gain-1)-(gain+1)*np.cos(Wn*2*np.pi)), (gain+1)-(gain-1)*np.cos(Wn*2*np.pi)-2*np.sqrt(gain)*alpha
-    sos = np.array([[b0/a0, b1/a0, b2/a0, 1, a1/a0, a2/a0]])
-    return sosfilt(sos, samples)
+        b0, b1, b2 = gain*((gain+1)+(gain-1)*cos_w0+shelf_term), -2*gain*((gain-1)+(gain+1)*cos_w0), gain*((gain+1)+(gain-1)*cos_w0-shelf_term)
+        a0, a1, a2 = (gain+1)-(gain-1)*cos_w0+shelf_term, 2*((gain-1)-(gain+1)*cos_w0), (gain+1)-(gain-1)*cos_w0-shelf_term
+    return [b0/a0, b1/a0, b2/a0, 1, a1/a0, a2/a0]
 
-def apply_peak_filter(samples, sample_rate, center_hz, gain_db, q=1.0):
-    if gain_db == 0: return samples
+def design_peak_filter(sample_rate, center_hz, gain_db, q=1.0):
+    """Returns one RBJ peaking biquad as an SOS row, or None when the gain is 0 dB."""
+    if gain_db == 0: return None
     nyquist = 0.5 * sample_rate
     Wn = center_hz / nyquist
     gain = 10.0**(gain_db / 20.0)
     alpha = np.sin(Wn*2*np.pi) / (2.0 * q)
-    b0, b1, b2 = 1+alpha*gain, -2*np.cos(Wn*2*np.pi), 1-alpha*gain
-    a0, a1, a2 = 1+alpha/gain, -2*np.cos(Wn*2*np.pi), 1-alpha/gain
-    sos = np.array([[b0/a0, b1/a0, b2/a0, 1, a1/a0, a2/a0]])
-    return sosfilt(sos, samples)
+    cos_term = -2*np.cos(Wn*2*np.pi)
+    b0, b1, b2 = 1+alpha*gain, cos_term, 1-alpha*gain
+    a0, a1, a2 = 1+alpha/gain, cos_term, 1-alpha/gain
+    return [b0/a0, b1/a0, b2/a0, 1, a1/a0, a2/a0]
     
-def apply_multiband_compressor(chunk, low_thresh, low_ratio, mid_thresh, mid_ratio, high_thresh, high_ratio, low_crossover=250, high_crossover=4000):
-    low_pass_sos = butter(4, low_crossover, btype='lowpass', fs=chunk.frame_rate, output='sos')
-    high_pass_sos = butter(4, high_crossover, btype='highpass', fs=chunk.frame_rate, output='sos')
-    samples = audio_segment_to_float_array(chunk)
-    low_band_samples = sosfilt(low_pass_sos, samples, axis=0)
-    high_band_samples_for_sub = sosfilt(high_pass_sos, samples, axis=0)
-    mid_band_samples = samples - low_band_samples - high_band_samples_for_sub
-    high_band_samples = high_band_samples_for_sub
-    low_band_chunk = float_array_to_audio_segment(low_band_samples, chunk)
-    mid_band_chunk = float_array_to_audio_segment(mid_band_samples, chunk)
-    high_band_chunk = float_array_to_audio_segment(high_band_samples, chunk)
-    low_compressed = compress_dynamic_range(low_band_chunk, threshold=low_thresh, ratio=low_ratio, attack=10.0, release=200.0)
-    mid_compressed = compress_dynamic_range(mid_band_chunk, threshold=mid_thresh, ratio=mid_ratio, attack=5.0, release=150.0)
-    high_compressed = compress_dynamic_range(high_band_chunk, threshold=high_thresh, ratio=high_ratio, attack=1.0, release=50.0)
-    return low_compressed.overlay(mid_compressed).overlay(high_compressed)
+def design_crossover_sos(sample_rate, low_crossover=250, high_crossover=4000):
+    """Returns the (low-pass, high-pass) Butterworth SOS pair that splits off the low and high bands."""
+    low_pass_sos = butter(4, low_crossover, btype='lowpass', fs=sample_rate, output='sos').astype(np.float32)
+    high_pass_sos = butter(4, high_crossover, btype='highpass', fs=sample_rate, output='sos').astype(np.float32)
+    return low_pass_sos, high_pass_sos
+
+def apply_multiband_compressor(samples, sample_rate, crossover_sos, low_thresh, low_ratio, mid_thresh, mid_ratio, high_thresh, high_ratio, filter_state=None):
+    low_pass_sos, high_pass_sos = crossover_sos
+    # The two crossover filters, and then the three band compressors, are independent of each other.
+    # sosfilt and the compressor kernel both release the GIL, so threads run them on separate cores.
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        low_band_future = executor.submit(stateful_sosfilt, low_pass_sos, samples, filter_state, 'crossover_low')
+        high_band_samples_for_sub = stateful_sosfilt(high_pass_sos, samples, filter_state, 'crossover_high')
+        low_band_samples = low_band_future.result()
+        mid_band_samples = samples - low_band_samples - high_band_samples_for_sub
+        high_band_samples = high_band_samples_for_sub
+        # The bands stay float and are summed directly; nothing is quantised until the final export.
+        low_compressed = executor.submit(compress_dynamic_range, low_band_samples, sample_rate, threshold=low_thresh, ratio=low_ratio, attack=10.0, release=200.0, state=filter_state, key='compressor_low')
+        mid_compressed = executor.submit(compress_dynamic_range, mid_band_samples, sample_rate, threshold=mid_thresh, ratio=mid_ratio, attack=5.0, release=150.0, state=filter_state, key='compressor_mid')
+        high_compressed = executor.submit(compress_dynamic_range, high_band_samples, sample_rate, threshold=high_thresh, ratio=high_ratio, attack=1.0, release=50.0, state=filter_state, key='compressor_high')
+        return low_compressed.result() + mid_compressed.result() + high_compressed.result()
+
+def stateful_sosfilt(sos, samples, state=None, key=None):
+    """Filters `samples` along axis 0 with `sos`, resuming from the filter memory stored under `key` in `state`."""
+    zi = state.get(key) if state is not None else None
+    if zi is None:
+        # Steady state for the first sample, so the filter doesn't ring up from silence.
+        zi = (sosfilt_zi(sos).reshape(sos.shape[0], 2, *([1] * (samples.ndim - 1))) * samples[0]).astype(np.float32)
+    filtered_samples, zf = sosfilt(sos, samples, axis=0, zi=zi)
+    if state is not None:
+        state[key] = zf
+    return filtered_samples
+
+def compress_dynamic_range(samples, sample_rate, threshold=-20.0, ratio=4.0, attack=5.0, release=50.0, state=None, key=None):
+    """
+    The same compressor as pydub.effects.compress_dynamic_range, run on a float array instead of an AudioSegment.
+    With a state dict, the level window and gain are carried over from the previous block under `key`.
+    """
+    frames = samples.reshape(len(samples), -1)
+    attack_frames = sample_rate * attack / 1000.0
+    release_frames = sample_rate * release / 1000.0
+    look_frames = int(attack_frames)
+    compressor_state = state.get(key) if state is not None else None
+    if compressor_state is None:
+        # (history of the last look_frames frames, [window energy, attenuation dB, frames seen])
+        # The energy sum stays float64 so millions of add/subtract steps don't drift.
+        compressor_state = (np.zeros((max(look_frames, 1), frames.shape[1]), dtype=np.float32), np.zeros(3))
+    out = _compress_kernel(frames, 10.0 ** (threshold / 20.0), ratio, attack_frames, release_frames, look_frames, *compressor_state)
+    if state is not None:
+        state[key] = compressor_state
+    return out.reshape(samples.shape)
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _compress_kernel(frames, thresh_rms, ratio, attack_frames, release_frames, look_frames, history, scalars):
+    # Level is the RMS of the look_frames frames before frame i, across all channels, kept as a running sum.
+    # Attenuation (dB) ramps linearly towards (1 - 1/ratio) * dB-over-threshold, as in pydub.
+    # history is a ring buffer of recent frames indexed by absolute frame number; it and scalars are updated in place.
+    n_frames, n_channels = frames.shape
+    out = np.empty_like(frames)
+    window_energy, attenuation, frames_seen = scalars[0], scalars[1], int(scalars[2])
+    for i in range(n_frames):
+        frame_index = frames_seen + i
+        window_size = min(frame_index, look_frames) * n_channels
+        rms = np.sqrt(max(window_energy, 0.0) / window_size) if window_size > 0 else 0.0
+
+        max_attenuation = 0.0
+        if rms > thresh_rms:
+            max_attenuation = (1.0 - 1.0 / ratio) * 20.0 * np.log10(rms / thresh_rms)
+        if rms > thresh_rms and attenuation <= max_attenuation:
+            attenuation = min(attenuation + max_attenuation / attack_frames, max_attenuation)
+        else:
+            attenuation = max(attenuation - max_attenuation / release_frames, 0.0)
+
+        gain = np.float32(10.0 ** (-attenuation / 20.0)) if attenuation != 0.0 else np.float32(1.0)
+        for ch in range(n_channels):
+            out[i, ch] = frames[i, ch] * gain
+
+        # Frame i joins the window and the frame look_frames before it drops out.
+        if look_frames > 0:
+            slot = frame_index % look_frames
+            for ch in range(n_channels):
+                window_energy += frames[i, ch] * frames[i, ch] - history[slot, ch] * history[slot, ch]
+                history[slot, ch] = frames[i, ch]
+    scalars[0], scalars[1], scalars[2] = window_energy, attenuation, frames_seen + n_frames
+    return out
 
 def normalize_to_lufs(samples, sample_rate, target_lufs=-14.0):
     meter = pyln.Meter(sample_rate)
-    if samples.ndim == 2:
-        mono_samples_for_measurement = samples.mean(axis=1)
+    if samples.shape[1] > 5:
+        # pyloudnorm only has BS.1770 channel weights for up to five channels; wider layouts are measured as a mono mix.
+        loudness = meter.integrated_loudness(samples.mean(axis=1))
     else:
-        mono_samples_for_measurement = samples
-    loudness = meter.integrated_loudness(mono_samples_for_measurement)
+        # pyloudnorm takes (n_frames, n_channels) directly and sums channel power per BS.1770, so no mono mix is built.
+        loudness = meter.integrated_loudness(samples)
     gain_db = target_lufs - loudness
-    gain_linear = 10.0 ** (gain_db / 20.0)
+    gain_linear = np.float32(10.0 ** (gain_db / 20.0))
     print(f"Current loudness: {loudness:.2f} LUFS. Applying {gain_db:.2f} dB gain...")
-    return samples * gain_linear
+    # Scaled in place: the caller owns the array, and a second full-length copy is what the block path avoids.
+    return np.multiply(samples, gain_linear, out=samples)
 
 def soft_limiter(samples, threshold=0.98):
-    clipped_indices = np.abs(samples) > threshold
-    samples[clipped_indices] = (threshold + (np.abs(samples[clipped_indices]) - threshold) / (1 + ((np.abs(samples[clipped_indices]) - threshold)/0.02)**2)**0.5) * np.sign(samples[clipped_indices])
-    return samples
\ No newline at end of file
+    flat = np.ravel(samples)
+    _soft_limit_kernel(flat, threshold)
+    return flat.reshape(samples.shape)
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _soft_limit_kernel(flat, threshold):
+    # One in-place pass: anything above the threshold is bent back towards it, keeping its sign.
+    for i in prange(flat.shape[0]):
+        magnitude = abs(flat[i])
+        if magnitude > threshold:
+            over = magnitude - threshold
+            flat[i] = np.copysign(threshold + over / np.sqrt(1.0 + (over / 0.02) ** 2), flat[i])
\ No newline at end of file
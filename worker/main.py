@@ -5,6 +5,8 @@
 import os
 import json
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request
 
 # Import our existing mastering engine! This file must be in the same folder.
@@ -12,10 +14,32 @@ from audio_mastering_engine import process_audio_from_gcs
 
 app = Flask(__name__)
 
+# Jobs run on these background threads so the push request can be acknowledged immediately.
+# Requires CPU to stay allocated between requests (Cloud Run: "CPU always allocated"), and a job that
+# was acknowledged but not finished is lost if the instance stops; see "Deploying the Cloud Worker" in README.md.
+MASTERING_WORKERS = int(os.environ.get('MASTERING_WORKERS', 2))
+job_executor = ThreadPoolExecutor(max_workers=MASTERING_WORKERS)
+
+# Caps running plus waiting jobs. Beyond it, messages are refused so Pub/Sub keeps them and redelivers later,
+# instead of piling up unbounded in this process's memory.
+MAX_JOBS_IN_FLIGHT = int(os.environ.get('MAX_JOBS_IN_FLIGHT', MASTERING_WORKERS))
+job_slots = threading.BoundedSemaphore(MAX_JOBS_IN_FLIGHT)
+
+def run_mastering_job(gcs_uri, settings):
+    """Runs one mastering job on a background thread, logs the outcome and frees its slot."""
+    try:
+        print(f"Starting processing job for {gcs_uri} with settings: {settings}")
+        process_audio_from_gcs(gcs_uri, settings)
+        print(f"Successfully completed processing for {gcs_uri}")
+    except Exception as e:
+        print(f"CRITICAL ERROR processing job for {gcs_uri}: {e}")
+    finally:
+        job_slots.release()
+
 @app.route('/', methods=['POST'])
 def process_mastering_job():
     """
-    Receives a Pub/Sub message, parses it, and calls the mastering engine.
+    Receives a Pub/Sub message, parses it, and queues the job for the mastering engine.
     This is the entry point for all processing jobs.
     """
     envelope = request.get_json()
@@ -35,12 +59,19 @@ def process_mastering_job():
             print(f"ERROR: Missing GCS URI or settings in job data: {job_data}")
             return "Bad Request: missing GCS URI or settings", 400
 
-        print(f"Starting processing job for {gcs_uri} with settings: {settings}")
-        process_audio_from_gcs(gcs_uri, settings)
-        print(f"Successfully completed processing for {gcs_uri}")
+        if not job_slots.acquire(blocking=False):
+            # A non-2xx response leaves the message unacknowledged; Pub/Sub redelivers it with backoff.
+            print(f"Worker busy ({MAX_JOBS_IN_FLIGHT} jobs in flight), asking Pub/Sub to retry {gcs_uri}")
+            return "Too Many Requests: worker is busy", 429
+        try:
+            job_executor.submit(run_mastering_job, gcs_uri, settings)
+        except Exception:
+            job_slots.release()
+            raise
+        print(f"Queued processing job for {gcs_uri}")
         
-        # Return a 204 Success (No Content) to acknowledge the message.
-        # This tells Pub/Sub the job was handled and not to send it again.
+        # Return a 204 Success (No Content) to acknowledge the message as soon as it is queued.
+        # This tells Pub/Sub the job was accepted and not to send it again.
         return "", 204
 
     except Exception as e: